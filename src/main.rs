@@ -1,58 +1,429 @@
 use std::env;
+use std::fs::File;
+use std::io::{self, BufRead, BufReader, BufWriter, Read, Write};
+use std::panic::{self, AssertUnwindSafe};
 
-use pushr::push::instructions::InstructionSet;
-use pushr::push::interpreter::PushInterpreter;
+use pushr::push::instructions::{InstructionCache, InstructionSet};
+use pushr::push::interpreter::{PushInterpreter, PushInterpreterState};
 use pushr::push::parser::PushParser;
+use pushr::push::report;
 use pushr::push::state::PushState;
 use pushr::push::item::Item;
 
+/// Maximum length of a program in server mode (bytes).
+const MAX_PROGRAM_LEN: u32 = 16 * 1024 * 1024;
+
+/// Output format of the final state.
+#[derive(Clone, Copy, PartialEq)]
+enum OutputFormat {
+    // Human readable block terminated by 'Done.'
+    Text,
+    // Single line JSON object
+    Json,
+    // Length-prefixed binary frames
+    Binary,
+}
+
 fn main() {
-    println!("> ------------------");
-    println!(">      PUSHR        ");
-    println!("> ------------------");
+    let mut args: Vec<String> = env::args().collect();
+    let binary = remove_flag(&mut args, "--binary");
+    let json = remove_flag(&mut args, "--json");
+    let format = match (binary, json) {
+        (true, true) => {
+            eprintln!("The flags --binary and --json can not be combined ... Done");
+            return;
+        }
+        (true, false) => OutputFormat::Binary,
+        (false, true) => OutputFormat::Json,
+        (false, false) => OutputFormat::Text,
+    };
+
+    if args.len() > 1 && args[1] == "--repl" {
+        let stdin = io::stdin();
+        let stdout = io::stdout();
+        if let Err(e) = run_lines(&args[0], stdin.lock(), &mut stdout.lock(), format) {
+            eprintln!("REPL terminated: {}", e);
+        }
+        return;
+    }
+    if args.len() > 1 && args[1] == "--server" {
+        let stdin = io::stdin();
+        let stdout = io::stdout();
+        if let Err(e) = run_server(&args[0], stdin.lock(), &mut stdout.lock(), format) {
+            eprintln!("Server terminated: {}", e);
+        }
+        return;
+    }
+    if args.len() > 1 && args[1] == "--batch" {
+        if args.len() < 3 {
+            eprintln!("No batch file ... Done");
+            return;
+        }
+        let stdout = io::stdout();
+        let result = File::open(&args[2]).and_then(|file| {
+            run_lines(&args[0], BufReader::new(file), &mut stdout.lock(), format)
+        });
+        if let Err(e) = result {
+            eprintln!("Batch terminated: {}", e);
+        }
+        return;
+    }
+
+    let trace = format == OutputFormat::Text;
+    if trace {
+        println!("> ------------------");
+        println!(">      PUSHR        ");
+        println!("> ------------------");
+    }
 
-    let args: Vec<String> = env::args().collect(); 
     if args.len() < 2 {
-        println!("No input ... Done");
+        if trace {
+            println!("No input ... Done");
+        }
         return;
     }
-    let input = &args[1]; 
-    println!("Input = {}", input);
+    let input = &args[1];
+    if trace {
+        println!("Input = {}", input);
+    }
 
-    let mut push_state = PushState::new();
     let mut instruction_set = InstructionSet::new();
+    instruction_set.load();
     let instruction_cache = instruction_set.cache();
 
-    // Load program
+    // Trace and final state are buffered and written in blocks
+    let stdout = io::stdout();
+    let mut out = BufWriter::new(stdout.lock());
+    let (push_state, interpreter_state) =
+        execute(&mut instruction_set, &instruction_cache, &args[0], input, &mut out, trace);
+
+    // Output final stack states for comparison
+    let _ = print_final_state(&mut out, &push_state, &interpreter_state, format);
+    let _ = out.flush();
+}
+
+/// Removes all occurences of the flag from the argument list. Returns
+/// true if the flag was present.
+fn remove_flag(args: &mut Vec<String>, flag: &str) -> bool {
+    let len_before = args.len();
+    args.retain(|a| a != flag);
+    args.len() != len_before
+}
+
+/// Reads one program per line (REPL: stdin, batch: file) and writes its
+/// final state to out after execution. The instruction set is loaded once
+/// and shared by all programs of the session. Empty lines are ignored.
+/// A program that panics is reported with the error 'Panic'.
+fn run_lines(
+    bin: &str,
+    reader: impl BufRead,
+    out: &mut impl Write,
+    format: OutputFormat,
+) -> io::Result<()> {
+    let mut instruction_set = InstructionSet::new();
     instruction_set.load();
-    PushParser::parse_program(&mut push_state, &instruction_set, &input);
-    PushParser::copy_to_code_stack(&mut push_state);
+    let instruction_cache = instruction_set.cache();
+
+    for line in reader.lines() {
+        let input = line?;
+        if input.trim().is_empty() {
+            continue;
+        }
+        match execute_guarded(&mut instruction_set, &instruction_cache, bin, &input) {
+            Some((push_state, interpreter_state)) => {
+                print_final_state(out, &push_state, &interpreter_state, format)?
+            }
+            None => print_panic(out, format)?,
+        }
+        out.flush()?;
+    }
+    Ok(())
+}
+
+/// Reads length-prefixed programs from the reader (stdin) and writes the final
+/// state of each program as length-prefixed payload to out. The length is a u32
+/// (little endian) followed by the UTF-8 bytes of the program. The payload
+/// is the JSON object of the final state or the binary frames if the binary
+/// format is selected. A program that panics is answered with the error 'Panic'
+/// (status PANIC_STATUS in binary format). The session ends when the input is
+/// closed.
+fn run_server(
+    bin: &str,
+    mut reader: impl Read,
+    out: &mut impl Write,
+    format: OutputFormat,
+) -> io::Result<()> {
+    let mut instruction_set = InstructionSet::new();
+    instruction_set.load();
+    let instruction_cache = instruction_set.cache();
 
-    // Inject interpreter binary 
-    push_state.name_bindings.insert("BIN".to_string(), Item::id(args[0].clone())); 
+    while let Some(len) = read_length(&mut reader)? {
+        if len > MAX_PROGRAM_LEN {
+            return Err(io::Error::new(
+                io::ErrorKind::InvalidData,
+                format!("program length {} exceeds {} bytes", len, MAX_PROGRAM_LEN),
+            ));
+        }
+        let mut program = vec![];
+        reader.by_ref().take(len as u64).read_to_end(&mut program)?;
+        if program.len() != len as usize {
+            return Err(io::Error::new(io::ErrorKind::UnexpectedEof, "truncated program"));
+        }
+        let input = String::from_utf8(program)
+            .map_err(|e| io::Error::new(io::ErrorKind::InvalidData, e))?;
+        let result = execute_guarded(&mut instruction_set, &instruction_cache, bin, &input);
+        let payload = match (result, format) {
+            (Some((push_state, interpreter_state)), OutputFormat::Binary) => {
+                report::state_frames(&push_state, &interpreter_state)
+            }
+            (Some((push_state, interpreter_state)), _) => {
+                report::state_json(&push_state, &interpreter_state).into_bytes()
+            }
+            (None, OutputFormat::Binary) => {
+                report::state_frames_with_status(&PushState::new(), report::PANIC_STATUS)
+            }
+            (None, _) => report::state_json_with_error(&PushState::new(), Some("Panic")).into_bytes(),
+        };
+        out.write_all(&(payload.len() as u32).to_le_bytes())?;
+        out.write_all(&payload)?;
+        out.flush()?;
+    }
+    Ok(())
+}
 
+/// Reads the length prefix (u32 LE) of the next program. Returns None if the
+/// input is closed before the first byte of the prefix.
+fn read_length(reader: &mut impl Read) -> io::Result<Option<u32>> {
+    let mut len_bytes = [0u8; 4];
     loop {
-        println!("> EXEC  : {}", push_state.exec_stack.to_string());
-        println!("> CODE  : {}", push_state.code_stack.to_string());
-        println!("> INT   : {}", push_state.int_stack.to_string());
-        println!("> ------------ ");
-        if PushInterpreter::step(&mut push_state, &mut instruction_set, &instruction_cache) {
-            break;
-       }
-    }
-    
-    // Output final stack states for comparison
-    println!("\n=== FINAL STATE ===");
-    let mut int_vec = push_state.int_stack.to_vec();
-    int_vec.reverse();
-    println!("Integer stack: {:?}", int_vec);
-    
-    let mut float_vec = push_state.float_stack.to_vec();
-    float_vec.reverse();
-    println!("Float stack: {:?}", float_vec);
-    
-    let mut bool_vec = push_state.bool_stack.to_vec();
-    bool_vec.reverse();
-    println!("Boolean stack: {:?}", bool_vec);
-    println!("Done.");
+        match reader.read(&mut len_bytes[..1]) {
+            Ok(0) => return Ok(None),
+            Ok(_) => break,
+            Err(ref e) if e.kind() == io::ErrorKind::Interrupted => continue,
+            Err(e) => return Err(e),
+        }
+    }
+    reader.read_exact(&mut len_bytes[1..])?;
+    Ok(Some(u32::from_le_bytes(len_bytes)))
+}
+
+/// Parses the program into a new state and runs it with PushInterpreter::run_with.
+/// Writes the intermediate stacks to out if trace is set.
+fn execute(
+    instruction_set: &mut InstructionSet,
+    instruction_cache: &InstructionCache,
+    bin: &str,
+    input: &str,
+    out: &mut impl Write,
+    trace: bool,
+) -> (PushState, PushInterpreterState) {
+    let mut push_state = PushState::new();
+
+    // Load program
+    PushParser::parse_program(&mut push_state, instruction_set, input);
+    PushParser::copy_to_code_stack(&mut push_state);
+
+    // Inject interpreter binary
+    push_state.name_bindings.insert("BIN".to_string(), Item::id(bin.to_string()));
+
+    let interpreter_state =
+        PushInterpreter::run_with(&mut push_state, instruction_set, instruction_cache, |state| {
+            if trace {
+                let _ = print_trace(out, state);
+            }
+        });
+    (push_state, interpreter_state)
+}
+
+/// Executes the program without trace like execute(). Returns None if the
+/// execution panicked so that a session can continue with the next program.
+fn execute_guarded(
+    instruction_set: &mut InstructionSet,
+    instruction_cache: &InstructionCache,
+    bin: &str,
+    input: &str,
+) -> Option<(PushState, PushInterpreterState)> {
+    panic::catch_unwind(AssertUnwindSafe(|| {
+        execute(instruction_set, instruction_cache, bin, input, &mut io::sink(), false)
+    }))
+    .ok()
+}
+
+/// Writes the EXEC, CODE and INTEGER stacks of an intermediate state.
+fn print_trace(out: &mut impl Write, push_state: &PushState) -> io::Result<()> {
+    writeln!(out, "> EXEC  : {}", push_state.exec_stack.to_string())?;
+    writeln!(out, "> CODE  : {}", push_state.code_stack.to_string())?;
+    writeln!(out, "> INT   : {}", push_state.int_stack.to_string())?;
+    writeln!(out, "> ------------ ")
+}
+
+/// Writes the integer, float and boolean stacks (top first). In text format
+/// each stack is written as JSON array and the block is terminated by a
+/// 'Done.' line. In JSON format the state is written as single line object.
+/// In binary format the stacks are written as frames (see report::state_frames).
+/// All formats additionally report if the execution was interrupted.
+fn print_final_state(
+    out: &mut impl Write,
+    push_state: &PushState,
+    interpreter_state: &PushInterpreterState,
+    format: OutputFormat,
+) -> io::Result<()> {
+    match format {
+        OutputFormat::Json => {
+            writeln!(out, "{}", report::state_json(push_state, interpreter_state))
+        }
+        OutputFormat::Binary => {
+            out.write_all(&report::state_frames(push_state, interpreter_state))
+        }
+        OutputFormat::Text => match interpreter_state {
+            PushInterpreterState::NoErrors => print_text_block(out, push_state, None),
+            _ => print_text_block(out, push_state, Some(format!("{:?}", interpreter_state).as_str())),
+        },
+    }
+}
+
+/// Writes the final state of a program that panicked: empty stacks with the
+/// error 'Panic' (status PANIC_STATUS in binary format).
+fn print_panic(out: &mut impl Write, format: OutputFormat) -> io::Result<()> {
+    let push_state = PushState::new();
+    match format {
+        OutputFormat::Json => {
+            writeln!(out, "{}", report::state_json_with_error(&push_state, Some("Panic")))
+        }
+        OutputFormat::Binary => {
+            out.write_all(&report::state_frames_with_status(&push_state, report::PANIC_STATUS))
+        }
+        OutputFormat::Text => print_text_block(out, &push_state, Some("Panic")),
+    }
+}
+
+/// Writes the text block with the stacks as JSON arrays, the error line if
+/// an error is given and the terminating 'Done.' line.
+fn print_text_block(
+    out: &mut impl Write,
+    push_state: &PushState,
+    error: Option<&str>,
+) -> io::Result<()> {
+    writeln!(out, "\n=== FINAL STATE ===")?;
+    writeln!(out, "Integer stack: {}", report::int_stack_json(push_state))?;
+    writeln!(out, "Float stack: {}", report::float_stack_json(push_state))?;
+    writeln!(out, "Boolean stack: {}", report::bool_stack_json(push_state))?;
+    if let Some(reason) = error {
+        writeln!(out, "Error: {}", reason)?;
+    }
+    writeln!(out, "Done.")
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::io::Cursor;
+
+    /// Returns the program prefixed by its length (u32 LE).
+    fn frame(program: &str) -> Vec<u8> {
+        let mut framed = (program.len() as u32).to_le_bytes().to_vec();
+        framed.extend_from_slice(program.as_bytes());
+        framed
+    }
+
+    /// Splits the server output into its length-prefixed payloads.
+    fn payloads(mut output: &[u8]) -> Vec<String> {
+        let mut result = vec![];
+        while !output.is_empty() {
+            let mut len_bytes = [0u8; 4];
+            len_bytes.copy_from_slice(&output[..4]);
+            let len = u32::from_le_bytes(len_bytes) as usize;
+            result.push(String::from_utf8(output[4..4 + len].to_vec()).unwrap());
+            output = &output[4 + len..];
+        }
+        result
+    }
+
+    #[test]
+    fn server_answers_each_framed_program() {
+        let mut input = frame("( 3 4 INTEGER.+ )");
+        input.extend(frame("( 1.5\nTRUE )"));
+        let mut out: Vec<u8> = vec![];
+        run_server("pushr", Cursor::new(input), &mut out, OutputFormat::Json).unwrap();
+        assert_eq!(
+            payloads(&out),
+            vec![
+                "{\"integer\": [7], \"float\": [], \"boolean\": []}",
+                "{\"integer\": [], \"float\": [1.5], \"boolean\": [true]}",
+            ]
+        );
+    }
+
+    #[test]
+    fn server_ends_session_on_closed_input() {
+        let mut out: Vec<u8> = vec![];
+        run_server("pushr", Cursor::new(Vec::<u8>::new()), &mut out, OutputFormat::Json).unwrap();
+        assert!(out.is_empty());
+    }
+
+    #[test]
+    fn server_rejects_truncated_length_prefix() {
+        let mut out: Vec<u8> = vec![];
+        let result = run_server("pushr", Cursor::new(vec![5u8, 0]), &mut out, OutputFormat::Json);
+        assert_eq!(result.unwrap_err().kind(), io::ErrorKind::UnexpectedEof);
+        assert!(out.is_empty());
+    }
+
+    #[test]
+    fn server_rejects_truncated_program() {
+        let mut input = frame("( 3 4 INTEGER.+ )");
+        input.truncate(8);
+        let mut out: Vec<u8> = vec![];
+        let result = run_server("pushr", Cursor::new(input), &mut out, OutputFormat::Json);
+        assert_eq!(result.unwrap_err().kind(), io::ErrorKind::UnexpectedEof);
+        assert!(out.is_empty());
+    }
+
+    #[test]
+    fn server_rejects_oversized_program() {
+        let input = (MAX_PROGRAM_LEN + 1).to_le_bytes().to_vec();
+        let mut out: Vec<u8> = vec![];
+        let result = run_server("pushr", Cursor::new(input), &mut out, OutputFormat::Json);
+        assert_eq!(result.unwrap_err().kind(), io::ErrorKind::InvalidData);
+        assert!(out.is_empty());
+    }
+
+    #[test]
+    fn server_continues_after_panicking_program() {
+        let mut input = frame("( FLOAT[1.0,NaN] FLOATVECTOR.SORT*ASC )");
+        input.extend(frame("( 3 4 INTEGER.+ )"));
+        let mut out: Vec<u8> = vec![];
+        run_server("pushr", Cursor::new(input), &mut out, OutputFormat::Json).unwrap();
+        assert_eq!(
+            payloads(&out),
+            vec![
+                "{\"integer\": [], \"float\": [], \"boolean\": [], \"error\": \"Panic\"}",
+                "{\"integer\": [7], \"float\": [], \"boolean\": []}",
+            ]
+        );
+    }
+
+    #[test]
+    fn lines_continue_after_panicking_program() {
+        let input = "( FLOAT[1.0,NaN] FLOATVECTOR.SORT*ASC )\n( 3 4 INTEGER.+ )\n";
+        let mut out: Vec<u8> = vec![];
+        run_lines("pushr", Cursor::new(input), &mut out, OutputFormat::Json).unwrap();
+        assert_eq!(
+            String::from_utf8(out).unwrap(),
+            "{\"integer\": [], \"float\": [], \"boolean\": [], \"error\": \"Panic\"}\n\
+             {\"integer\": [7], \"float\": [], \"boolean\": []}\n"
+        );
+    }
+
+    #[test]
+    fn lines_skip_blank_lines() {
+        let input = "( 3 4 INTEGER.+ )\n\n   \n( 2 INTEGER.DUP )\n";
+        let mut out: Vec<u8> = vec![];
+        run_lines("pushr", Cursor::new(input), &mut out, OutputFormat::Json).unwrap();
+        assert_eq!(
+            String::from_utf8(out).unwrap(),
+            "{\"integer\": [7], \"float\": [], \"boolean\": []}\n\
+             {\"integer\": [2, 2], \"float\": [], \"boolean\": []}\n"
+        );
+    }
 }
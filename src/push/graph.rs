@@ -842,7 +842,6 @@ impl Node {
                      if let Some(ids) = push_state.int_stack.pop_vec(2) {
                         let origin_id = ids[0].to_usize().unwrap_or(0);
                         let destination_id = ids[1].to_usize().unwrap_or(0);
-                        println!("Origin = {}, Destination = {}", origin_id,destination_id);
                         if let Some(weight) = graph.get_weight(&origin_id, &destination_id) {
                            push_state.float_stack.push(weight);
                         }
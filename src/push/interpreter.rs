@@ -84,6 +84,18 @@ impl PushInterpreter {
     ) -> PushInterpreterState {
         PushInterpreter::copy_to_code_stack(push_state);
         let icache = instruction_set.cache();
+        PushInterpreter::run_with(push_state, instruction_set, &icache, |_| {})
+    }
+
+    /// Runs the execution stack until it is empty. The callback is invoked with
+    /// the current state before each step. Stops execution if Step Limit, Time
+    /// Limit or Growth Cap are exceeded and returns corresponding error code.
+    pub fn run_with(
+        push_state: &mut PushState,
+        instruction_set: &mut InstructionSet,
+        icache: &InstructionCache,
+        mut on_step: impl FnMut(&PushState),
+    ) -> PushInterpreterState {
         let mut step_counter = 0;
         let start = Instant::now();
         loop {
@@ -93,8 +105,9 @@ impl PushInterpreter {
             if start.elapsed() > Duration::from_millis(push_state.configuration.eval_time_limit) {
                 return PushInterpreterState::TimeLimitExceeded;
             }
+            on_step(push_state);
             let size_before_step = push_state.size();
-            if PushInterpreter::step(push_state, instruction_set, &icache) {
+            if PushInterpreter::step(push_state, instruction_set, icache) {
                 break;
             }
             if push_state.size() > size_before_step + push_state.configuration.growth_cap.to_usize().unwrap_or(0) {
@@ -194,6 +207,37 @@ mod tests {
         assert_eq!(push_state.int_stack.to_string(), "24");
     }
 
+    #[test]
+    pub fn run_stops_non_terminating_program() {
+        let input = "( EXEC.Y ( ) )";
+        let mut push_state = PushState::new();
+        let mut instruction_set = InstructionSet::new();
+        instruction_set.load();
+        PushParser::parse_program(&mut push_state, &instruction_set, &input);
+        assert_eq!(
+            PushInterpreter::run(&mut push_state, &mut instruction_set),
+            PushInterpreterState::StepLimitExceeded
+        );
+    }
+
+    #[test]
+    pub fn run_with_invokes_callback_before_each_step() {
+        let input = "( 2 3 INTEGER.* )";
+        let mut push_state = PushState::new();
+        let mut instruction_set = InstructionSet::new();
+        instruction_set.load();
+        PushParser::parse_program(&mut push_state, &instruction_set, &input);
+        let icache = instruction_set.cache();
+        let mut steps = 0;
+        assert_eq!(
+            PushInterpreter::run_with(&mut push_state, &mut instruction_set, &icache, |_| steps += 1),
+            PushInterpreterState::NoErrors
+        );
+        // List, 2, 3, INTEGER.* and the final step on the empty stack
+        assert_eq!(steps, 5);
+        assert_eq!(push_state.int_stack.to_string(), "6");
+    }
+
     #[test]
     pub fn run_execution_loop() {
         // This should calculate the sum of the iteration variable: 0+1+2+3
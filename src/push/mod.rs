@@ -15,6 +15,7 @@ pub mod list;
 pub mod name;
 pub mod parser;
 pub mod random;
+pub mod report;
 pub mod stack;
 pub mod state;
 pub mod topology;
@@ -0,0 +1,262 @@
+use crate::push::interpreter::PushInterpreterState;
+use crate::push::state::PushState;
+use num_traits::ToPrimitive;
+
+/// Formats a float as JSON number. Non-finite values are written as NaN,
+/// Infinity and -Infinity which are accepted by the common JSON readers
+/// (e.g. Python's json module).
+pub fn json_float(val: f64) -> String {
+    if val.is_nan() {
+        "NaN".to_string()
+    } else if val.is_infinite() {
+        if val > 0.0 {
+            "Infinity".to_string()
+        } else {
+            "-Infinity".to_string()
+        }
+    } else {
+        format!("{:?}", val)
+    }
+}
+
+/// Joins the formatted elements to a JSON array.
+fn json_array<T>(elements: impl Iterator<Item = T>, fmt: impl Fn(T) -> String) -> String {
+    let items: Vec<String> = elements.map(fmt).collect();
+    format!("[{}]", items.join(", "))
+}
+
+/// Returns the INTEGER stack as JSON array. The first element
+/// is the top of the stack.
+pub fn int_stack_json(push_state: &PushState) -> String {
+    json_array(push_state.int_stack.to_vec().iter().rev(), |v| v.to_string())
+}
+
+/// Returns the FLOAT stack as JSON array. The first element
+/// is the top of the stack.
+pub fn float_stack_json(push_state: &PushState) -> String {
+    json_array(push_state.float_stack.to_vec().iter().rev(), |v| json_float(*v))
+}
+
+/// Returns the BOOLEAN stack as JSON array. The first element
+/// is the top of the stack.
+pub fn bool_stack_json(push_state: &PushState) -> String {
+    json_array(push_state.bool_stack.to_vec().iter().rev(), |v| v.to_string())
+}
+
+/// Returns the INTEGER, FLOAT and BOOLEAN stacks as single line JSON object
+/// with the keys 'integer', 'float' and 'boolean'. If the execution was
+/// interrupted the object contains the reason under the key 'error'.
+pub fn state_json(push_state: &PushState, interpreter_state: &PushInterpreterState) -> String {
+    match interpreter_state {
+        PushInterpreterState::NoErrors => state_json_with_error(push_state, None),
+        _ => state_json_with_error(push_state, Some(format!("{:?}", interpreter_state).as_str())),
+    }
+}
+
+/// Like state_json but with an arbitrary error reason (e.g. 'Panic').
+pub fn state_json_with_error(push_state: &PushState, error: Option<&str>) -> String {
+    let error = match error {
+        None => "".to_string(),
+        Some(reason) => format!(", \"error\": \"{}\"", reason),
+    };
+    format!(
+        "{{\"integer\": {}, \"float\": {}, \"boolean\": {}{}}}",
+        int_stack_json(push_state),
+        float_stack_json(push_state),
+        bool_stack_json(push_state),
+        error
+    )
+}
+
+/// Appends a frame header consisting of the tag byte and the element
+/// count (u32, little endian).
+fn push_frame_header(frame: &mut Vec<u8>, tag: u8, n: usize) {
+    frame.push(tag);
+    frame.extend_from_slice(&(n as u32).to_le_bytes());
+}
+
+/// Status code of the 'E' frame if the execution panicked.
+pub const PANIC_STATUS: u8 = 255;
+
+/// Returns the status code of the interpreter state used in the 'E' frame.
+pub fn status_code(interpreter_state: &PushInterpreterState) -> u8 {
+    match interpreter_state {
+        PushInterpreterState::NoErrors => 0,
+        PushInterpreterState::StepLimitExceeded => 1,
+        PushInterpreterState::TimeLimitExceeded => 2,
+        PushInterpreterState::GrowthCapExceeded => 3,
+    }
+}
+
+/// Returns the INTEGER, FLOAT and BOOLEAN stacks (top first) followed by the
+/// interpreter state as binary frames. Each frame starts with a tag byte and
+/// the element count n (u32 LE):
+///
+/// * 'I': n * 8 bytes of i64 LE. Used if all integers fit into 64 bits.
+/// * 'N': n times a byte length (u32 LE) followed by the two's-complement
+///        bytes (LE) of the integer. Used for arbitrary precision integers.
+/// * 'F': n * 8 bytes of f64 LE.
+/// * 'B': n bytes with 1 for TRUE and 0 for FALSE.
+/// * 'E': one byte with the status code (see status_code), 0 if the
+///        execution was not interrupted.
+pub fn state_frames(push_state: &PushState, interpreter_state: &PushInterpreterState) -> Vec<u8> {
+    state_frames_with_status(push_state, status_code(interpreter_state))
+}
+
+/// Like state_frames but with an arbitrary status code in the 'E' frame
+/// (e.g. PANIC_STATUS).
+pub fn state_frames_with_status(push_state: &PushState, status: u8) -> Vec<u8> {
+    let mut frames = vec![];
+    let ints: Vec<_> = push_state.int_stack.to_vec().into_iter().rev().collect();
+    let small_ints: Option<Vec<i64>> = ints.iter().map(|v| v.to_i64()).collect();
+    match small_ints {
+        Some(vals) => {
+            push_frame_header(&mut frames, b'I', vals.len());
+            for v in vals {
+                frames.extend_from_slice(&v.to_le_bytes());
+            }
+        }
+        None => {
+            push_frame_header(&mut frames, b'N', ints.len());
+            for v in ints {
+                let bytes = v.to_signed_bytes_le();
+                frames.extend_from_slice(&(bytes.len() as u32).to_le_bytes());
+                frames.extend_from_slice(&bytes);
+            }
+        }
+    }
+    let floats = push_state.float_stack.to_vec();
+    push_frame_header(&mut frames, b'F', floats.len());
+    for v in floats.iter().rev() {
+        frames.extend_from_slice(&v.to_le_bytes());
+    }
+    let bools = push_state.bool_stack.to_vec();
+    push_frame_header(&mut frames, b'B', bools.len());
+    for v in bools.iter().rev() {
+        frames.push(*v as u8);
+    }
+    push_frame_header(&mut frames, b'E', 1);
+    frames.push(status);
+    frames
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use num_bigint::BigInt;
+
+    #[test]
+    fn json_float_writes_non_finite_values() {
+        assert_eq!(json_float(1.5), "1.5");
+        assert_eq!(json_float(-2.0), "-2.0");
+        assert_eq!(json_float(f64::NAN), "NaN");
+        assert_eq!(json_float(f64::INFINITY), "Infinity");
+        assert_eq!(json_float(f64::NEG_INFINITY), "-Infinity");
+    }
+
+    #[test]
+    fn stacks_are_written_top_first() {
+        let mut test_state = PushState::new();
+        test_state.int_stack.push(BigInt::from(1));
+        test_state.int_stack.push(BigInt::from(-2));
+        test_state.float_stack.push(0.5);
+        test_state.float_stack.push(f64::NAN);
+        test_state.bool_stack.push(true);
+        test_state.bool_stack.push(false);
+        assert_eq!(int_stack_json(&test_state), "[-2, 1]");
+        assert_eq!(float_stack_json(&test_state), "[NaN, 0.5]");
+        assert_eq!(bool_stack_json(&test_state), "[false, true]");
+    }
+
+    #[test]
+    fn empty_stacks_are_written_as_empty_arrays() {
+        let test_state = PushState::new();
+        assert_eq!(int_stack_json(&test_state), "[]");
+        assert_eq!(float_stack_json(&test_state), "[]");
+        assert_eq!(bool_stack_json(&test_state), "[]");
+    }
+
+    #[test]
+    fn state_json_contains_all_scalar_stacks() {
+        let mut test_state = PushState::new();
+        test_state.int_stack.push(BigInt::from(7));
+        test_state.float_stack.push(f64::INFINITY);
+        test_state.bool_stack.push(true);
+        assert_eq!(
+            state_json(&test_state, &PushInterpreterState::NoErrors),
+            "{\"integer\": [7], \"float\": [Infinity], \"boolean\": [true]}"
+        );
+    }
+
+    #[test]
+    fn state_json_reports_interrupted_execution() {
+        let test_state = PushState::new();
+        assert_eq!(
+            state_json(&test_state, &PushInterpreterState::StepLimitExceeded),
+            "{\"integer\": [], \"float\": [], \"boolean\": [], \"error\": \"StepLimitExceeded\"}"
+        );
+    }
+
+    #[test]
+    fn state_frames_write_small_integers_as_i64() {
+        let mut test_state = PushState::new();
+        test_state.int_stack.push(BigInt::from(1));
+        test_state.int_stack.push(BigInt::from(-2));
+        test_state.float_stack.push(0.5);
+        test_state.bool_stack.push(true);
+        test_state.bool_stack.push(false);
+        let mut expected = vec![b'I', 2, 0, 0, 0];
+        expected.extend_from_slice(&(-2i64).to_le_bytes());
+        expected.extend_from_slice(&1i64.to_le_bytes());
+        expected.extend_from_slice(&[b'F', 1, 0, 0, 0]);
+        expected.extend_from_slice(&0.5f64.to_le_bytes());
+        expected.extend_from_slice(&[b'B', 2, 0, 0, 0, 0, 1]);
+        expected.extend_from_slice(&[b'E', 1, 0, 0, 0, 0]);
+        assert_eq!(state_frames(&test_state, &PushInterpreterState::NoErrors), expected);
+    }
+
+    #[test]
+    fn state_frames_report_interrupted_execution() {
+        let test_state = PushState::new();
+        let expected = vec![
+            b'I', 0, 0, 0, 0, b'F', 0, 0, 0, 0, b'B', 0, 0, 0, 0, b'E', 1, 0, 0, 0, 1,
+        ];
+        assert_eq!(
+            state_frames(&test_state, &PushInterpreterState::StepLimitExceeded),
+            expected
+        );
+    }
+
+    #[test]
+    fn state_json_with_error_reports_given_reason() {
+        let test_state = PushState::new();
+        assert_eq!(
+            state_json_with_error(&test_state, Some("Panic")),
+            "{\"integer\": [], \"float\": [], \"boolean\": [], \"error\": \"Panic\"}"
+        );
+    }
+
+    #[test]
+    fn state_frames_with_status_writes_given_status() {
+        let test_state = PushState::new();
+        let expected = vec![
+            b'I', 0, 0, 0, 0, b'F', 0, 0, 0, 0, b'B', 0, 0, 0, 0, b'E', 1, 0, 0, 0, PANIC_STATUS,
+        ];
+        assert_eq!(state_frames_with_status(&test_state, PANIC_STATUS), expected);
+    }
+
+    #[test]
+    fn state_frames_write_big_integers_with_length_prefix() {
+        let mut test_state = PushState::new();
+        let big = BigInt::from(i64::MAX) * BigInt::from(4);
+        test_state.int_stack.push(big.clone());
+        test_state.int_stack.push(BigInt::from(-1));
+        let mut expected = vec![b'N', 2, 0, 0, 0];
+        expected.extend_from_slice(&[1, 0, 0, 0, 0xff]);
+        let big_bytes = big.to_signed_bytes_le();
+        expected.extend_from_slice(&(big_bytes.len() as u32).to_le_bytes());
+        expected.extend_from_slice(&big_bytes);
+        expected.extend_from_slice(&[b'F', 0, 0, 0, 0, b'B', 0, 0, 0, 0, b'E', 1, 0, 0, 0, 0]);
+        assert_eq!(state_frames(&test_state, &PushInterpreterState::NoErrors), expected);
+    }
+}